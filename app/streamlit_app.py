@@ -3,6 +3,7 @@ import sys
 from pathlib import Path
 import mimetypes
 import json
+import hashlib
 import uuid  
 
 # Ensure imports work when Streamlit runs from /app
@@ -11,13 +12,16 @@ if PROJECT_ROOT not in sys.path:
     sys.path.insert(0, PROJECT_ROOT)
 
 import streamlit as st
-from rag.qa import answer_question
-from rag.retrieval import load_vectorstore  # keep this at top-level
+from rag.qa import answer_question_stream, finalize_answer
+from rag.ingest import load_chunks, StaleChunksError
+from rag.retrieval import load_vectorstore, prepare_bm25  # keep this at top-level
 
 # ---------- Paths for source linking ----------
 PROJECT_ROOT_PATH = Path(PROJECT_ROOT)
 RAW_DIR = PROJECT_ROOT_PATH / "data" / "raw"
-CHAT_SAVE_PATH = PROJECT_ROOT_PATH / "data" / "processed" / "chat_history.json"
+# append-only: one JSON turn per line
+CHAT_SAVE_PATH = PROJECT_ROOT_PATH / "data" / "processed" / "chat_history.jsonl"
+LEGACY_CHAT_SAVE_PATH = PROJECT_ROOT_PATH / "data" / "processed" / "chat_history.json"
 
 
 def resolve_source_path(source: str) -> Path | None:
@@ -35,23 +39,80 @@ def resolve_source_path(source: str) -> Path | None:
     return p if p.exists() else None
 
 
-def file_bytes_and_type(path: Path):
-    data = path.read_bytes()
-    mime, _ = mimetypes.guess_type(str(path))
+@st.cache_data(max_entries=32)
+def file_bytes_and_type(path: str):
+    # cached across reruns so source files aren't re-read on every render
+    data = Path(path).read_bytes()
+    mime, _ = mimetypes.guess_type(path)
     return data, (mime or "application/octet-stream")
 
 
+def stable_hash(text: str) -> str:
+    # unlike hash(), identical across processes, so widget keys survive restarts
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def write_chat_atomic(turns):
+    # whole-file rewrite: write a temp file, then atomically swap it in
+    CHAT_SAVE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = CHAT_SAVE_PATH.with_suffix(".jsonl.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for t in turns:
+            f.write(json.dumps(t) + "\n")
+    os.replace(tmp_path, CHAT_SAVE_PATH)
+
+
+def _ends_with_newline(path: Path) -> bool:
+    # an empty/missing file counts as clean; a torn last line does not
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                return True
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+    except FileNotFoundError:
+        return True
+
+
 def load_chat_from_disk():
+    turns = []
     if CHAT_SAVE_PATH.exists():
+        damaged = False
+        with open(CHAT_SAVE_PATH, encoding="utf-8") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    damaged = True
+                try:
+                    turns.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # e.g. a torn last line from a crash mid-append
+                    damaged = True
+        if damaged:
+            # drop the torn tail so later appends start on a fresh line
+            write_chat_atomic(turns)
+    elif LEGACY_CHAT_SAVE_PATH.exists():
         try:
-            st.session_state.chat = json.loads(CHAT_SAVE_PATH.read_text(encoding="utf-8"))
+            turns = json.loads(LEGACY_CHAT_SAVE_PATH.read_text(encoding="utf-8"))
+            write_chat_atomic(turns)
         except Exception:
-            st.session_state.chat = []
+            turns = []
+
+    st.session_state.chat = turns
+    st.session_state.persisted_turns = len(turns)
 
 
 def save_chat_to_disk():
+    # O(new turns) per message: only append what isn't on disk yet
+    start = st.session_state.get("persisted_turns", 0)
+    new_turns = st.session_state.chat[start:]
+    if not new_turns:
+        return
     CHAT_SAVE_PATH.parent.mkdir(parents=True, exist_ok=True)
-    CHAT_SAVE_PATH.write_text(json.dumps(st.session_state.chat, indent=2), encoding="utf-8")
+    prefix = "" if _ends_with_newline(CHAT_SAVE_PATH) else "\n"
+    with open(CHAT_SAVE_PATH, "a", encoding="utf-8") as f:
+        f.write(prefix + "".join(json.dumps(t) + "\n" for t in new_turns))
+    st.session_state.persisted_turns = len(st.session_state.chat)
 
 
 
@@ -79,14 +140,14 @@ def render_citations_grouped(citations, show_chunk_preview, all_docs_for_bm25, s
             # Download/Open button for local doc
             p = resolve_source_path(src)
             if p:
-                data, mime = file_bytes_and_type(p)
+                data, mime = file_bytes_and_type(str(p))
                 st.download_button(
                     label="⬇️ Download / Open source file",
                     data=data,
                     file_name=p.name,
                     mime=mime,
                     
-                    key=f"dl_{scope_key}_{hash(src)}_{i}",
+                    key=f"dl_{scope_key}_{stable_hash(src)}_{i}",
                     use_container_width=True,
                 )
             else:
@@ -139,11 +200,25 @@ for t in st.session_state.chat:
         t["id"] = str(uuid.uuid4())
 
 @st.cache_resource
-def load_docs_for_bm25():
-   
-    vs = load_vectorstore()
-    return list(vs.docstore._dict.values())
+def get_vectorstore():
+    return load_vectorstore()
+
 
+@st.cache_resource
+def load_docs_for_bm25():
+    # an immutable tuple: cached once per process and shared by every session
+    try:
+        docs = tuple(load_chunks())
+    except (FileNotFoundError, StaleChunksError):
+        # no chunks file, or one from a different build than the index:
+        # fall back to the FAISS docstore, which always matches the index
+        vs = get_vectorstore()
+        docs = tuple(vs.docstore._dict.values())
+    # build the per-industry BM25 indices once, not on the first question
+    prepare_bm25(docs)
+    return docs
+
+vectorstore = get_vectorstore()
 all_docs_for_bm25 = load_docs_for_bm25()
 
 # Render chat history (including citations)
@@ -168,15 +243,18 @@ if q:
     # chat_history should be List[Tuple[q, answer]]
     chat_pairs = [(t["q"], t["answer"]) for t in st.session_state.chat]
 
-    result = answer_question(
+    stream, docs = answer_question_stream(
         question=q,
         all_docs_for_bm25=all_docs_for_bm25,
         industry_filter=industry,
         chat_history=chat_pairs,
+        vectorstore=vectorstore,
     )
 
     with st.chat_message("assistant"):
-        st.write(result["answer"])
+        # tokens render as they arrive; citations are resolved from the full text
+        streamed = st.write_stream(stream)
+        result = finalize_answer(streamed, docs)
         render_citations_grouped(
             result.get("citations", []),
             show_chunk_preview,
@@ -0,0 +1,175 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from typing import Any, Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from rag.config import QUERY_BATCH_MS, QUERY_MAX_BATCH
+
+# (query, allowed FAISS ids or None, future)
+_Pending = Tuple[str, Optional[np.ndarray], Future]
+Hit = Tuple[int, Document, float]
+
+
+def search_params_with_selector(
+    index: faiss.Index, sel: faiss.IDSelector
+) -> Optional[faiss.SearchParameters]:
+    """
+    SearchParameters that restrict `index` to the ids in `sel`, or None when the
+    index type has no selector support (e.g. GPU indices). The index's own
+    efSearch/nprobe are carried over, since params replace them during search.
+    """
+    if isinstance(index, faiss.IndexPreTransform):
+        inner = search_params_with_selector(faiss.downcast_index(index.index), sel)
+        if inner is None:
+            return None
+        return faiss.SearchParametersPreTransform(index_params=inner)
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=sel, efSearch=index.hnsw.efSearch)
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=sel, nprobe=index.nprobe)
+    if isinstance(index, faiss.IndexFlat):
+        return faiss.SearchParameters(sel=sel)
+    return None
+
+
+def _resolve(fut: Future, result: Any = None, exception: Optional[BaseException] = None) -> None:
+    try:
+        if exception is not None:
+            fut.set_exception(exception)
+        else:
+            fut.set_result(result)
+    except InvalidStateError:
+        pass  # already resolved/cancelled; nobody is waiting on it
+
+
+class QueryBatcher:
+    """
+    Micro-batches vector searches: queries arriving within QUERY_BATCH_MS of each
+    other are embedded in one request and searched with one index.search() call
+    per distinct id filter.
+
+    Runs on a worker thread (not an asyncio task) because every Streamlit session
+    drives its own event loop; a thread-safe queue lets them share batches.
+    """
+
+    def __init__(
+        self,
+        vs: FAISS,
+        k: int,
+        max_batch: int = QUERY_MAX_BATCH,
+        batch_ms: float = QUERY_BATCH_MS,
+    ):
+        self.vs = vs
+        self.k = k
+        self.max_batch = max_batch
+        self.batch_s = batch_ms / 1000.0
+        self._queue: "queue.Queue[_Pending]" = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="faiss-query-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, query: str, allowed_ids: Optional[np.ndarray] = None) -> Future:
+        fut: Future = Future()
+        self._queue.put((query, allowed_ids, fut))
+        return fut
+
+    async def asearch(self, query: str, allowed_ids: Optional[np.ndarray] = None) -> List[Hit]:
+        """
+        (FAISS id, doc, relevance score) triples, best first; scores match
+        similarity_search_with_relevance_scores. `allowed_ids` (int64) is pushed
+        into the FAISS search; if the index can't filter, up to 2*k unfiltered
+        hits come back and the caller must filter them.
+        """
+        return await asyncio.wrap_future(self.submit(query, allowed_ids))
+
+    def _collect(self) -> List[_Pending]:
+        batch: List[_Pending] = []
+        deadline = None
+        while len(batch) < self.max_batch:
+            if deadline is None:
+                item = self._queue.get()
+            else:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+            # callers awaiting via wrap_future cancel this future when they are
+            # cancelled; drop those instead of searching for them
+            if not item[2].set_running_or_notify_cancel():
+                continue
+            batch.append(item)
+            if deadline is None:
+                deadline = time.monotonic() + self.batch_s
+        return batch
+
+    def _run(self) -> None:
+        # must never die: every session's vector search goes through this thread
+        while True:
+            batch = self._collect()
+            try:
+                results = self._search(batch)
+            except Exception as e:
+                for _, _, fut in batch:
+                    _resolve(fut, exception=e)
+                continue
+            for (_, _, fut), res in zip(batch, results):
+                _resolve(fut, result=res)
+
+    def _search(self, batch: List[_Pending]) -> List[List[Hit]]:
+        vs = self.vs
+        vectors = np.asarray(vs.embeddings.embed_documents([q for q, _, _ in batch]), dtype="float32")
+        if vs._normalize_L2:
+            faiss.normalize_L2(vectors)
+
+        # queries sharing a filter (callers pass the same cached array) share a search
+        groups: Dict[Optional[int], List[int]] = {}
+        for row, (_, allowed_ids, _) in enumerate(batch):
+            groups.setdefault(None if allowed_ids is None else id(allowed_ids), []).append(row)
+
+        results: List[List[Hit]] = [[] for _ in batch]
+        for rows in groups.values():
+            distances, ids = self._search_index(vectors[rows], batch[rows[0]][1])
+            for row, row_dist, row_ids in zip(rows, distances, ids):
+                results[row] = self._to_hits(row_dist, row_ids)
+        return results
+
+    def _search_index(
+        self, vectors: np.ndarray, allowed_ids: Optional[np.ndarray]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        index = self.vs.index
+        if allowed_ids is None:
+            return index.search(vectors, self.k)
+
+        # IDSelectorBatch (hash set) rather than IDSelectorArray (linear scan per
+        # candidate): allowed sets are whole industries, i.e. thousands of ids
+        sel = faiss.IDSelectorBatch(allowed_ids)
+        params = search_params_with_selector(index, sel)
+        if params is not None:
+            try:
+                return index.search(vectors, self.k, params=params)
+            except RuntimeError:
+                pass  # index type rejects selectors at search time
+
+        # no push-down available: over-fetch, the caller post-filters
+        return index.search(vectors, self.k * 2)
+
+    def _to_hits(self, row_dist: np.ndarray, row_ids: np.ndarray) -> List[Hit]:
+        vs = self.vs
+        # same distance -> relevance mapping LangChain applies per query
+        relevance = vs._select_relevance_score_fn()
+        hits = []
+        for dist, i in zip(row_dist, row_ids):
+            if i == -1:
+                continue
+            doc = vs.docstore.search(vs.index_to_docstore_id[i])
+            hits.append((int(i), doc, relevance(float(dist))))
+        return hits
@@ -0,0 +1,73 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Hashable, List, Dict
+
+import diskcache
+
+from rag.config import PROCESSED_DIR, ANSWER_CACHE_DIR
+
+_INDEX_VERSION_KEY = "__index_version__"
+
+
+class LRUCache:
+    """Small thread-safe LRU (Streamlit sessions query from different threads)."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+def normalize_query(text: str) -> str:
+    return " ".join(text.split()).casefold()
+
+
+def index_version() -> str:
+    # build_index rewrites the manifest on every rebuild, so its hash identifies the index
+    manifest_path = os.path.join(PROCESSED_DIR, "manifest.json")
+    try:
+        with open(manifest_path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return ""
+
+
+@lru_cache(maxsize=1)
+def get_answer_cache() -> diskcache.Cache:
+    """
+    On-disk answer cache. Entries written against a previous index are dropped
+    the first time the cache is opened after a rebuild.
+    """
+    cache = diskcache.Cache(ANSWER_CACHE_DIR)
+    version = index_version()
+    if cache.get(_INDEX_VERSION_KEY) != version:
+        cache.clear()
+        cache.set(_INDEX_VERSION_KEY, version)
+    return cache
+
+
+def answer_cache_key(model: str, messages: List[Dict[str, str]]) -> str:
+    payload = json.dumps({"model": model, "messages": messages}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
@@ -10,9 +10,32 @@ OPENAI_EMBED_MODEL = os.getenv("OPENAI_EMBED_MODEL", "text-embedding-3-small")
 RAW_DIR = "data/raw"
 PROCESSED_DIR = "data/processed"
 VECTORSTORE_DIR = "vectorstore/faiss"
+CHUNKS_FILE = "data/processed/chunks.arrow"  # written by build_index, mmapped by the UI
+
+# texts per embeddings request, and how many requests run at once while indexing
+EMBED_BATCH_SIZE = 512
+EMBED_CONCURRENCY = 4
 
 CHUNK_SIZE = 900
 CHUNK_OVERLAP = 150
 
+# FAISS index layout (quantized storage): HNSW over 8-bit scalar-quantized vectors
+# for normal corpora, OPQ + IVF + 4-bit FastScan PQ once the corpus is large
+FAISS_HNSW_FACTORY = "HNSW32,SQ8"
+FAISS_IVFPQ_FACTORY = "OPQ16_64,IVF256,PQ16x4fs"
+FAISS_IVFPQ_MIN_CHUNKS = 100_000
+FAISS_EF_SEARCH = 64
+FAISS_NPROBE = 16
+# move the loaded index to GPU(s) when faiss-gpu and a CUDA device are present
+FAISS_USE_GPU = os.getenv("FAISS_USE_GPU", "1") == "1"
+
+# queries arriving within QUERY_BATCH_MS share one embeddings call + one FAISS search
+QUERY_BATCH_MS = 20
+QUERY_MAX_BATCH = 32
+
+# repeated questions: in-memory retrieval LRU + on-disk answer cache (cleared on rebuild)
+RETRIEVAL_CACHE_SIZE = 256
+ANSWER_CACHE_DIR = "data/processed/answer_cache"
+
 TOP_K = 5
 MIN_RELEVANCE = 0.22  # tune after you ingest (keeps "I don't know" honest)
\ No newline at end of file
@@ -1,12 +1,60 @@
 import os
 import json
+import asyncio
+import uuid
+from datetime import datetime, timezone
 from typing import List
 
+import faiss
+import numpy as np
 from langchain_openai import OpenAIEmbeddings
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
 
-from rag.config import OPENAI_EMBED_MODEL, OPENAI_API_KEY, VECTORSTORE_DIR, PROCESSED_DIR
-from rag.ingest import ingest_all
+from rag.config import (
+    OPENAI_EMBED_MODEL,
+    OPENAI_API_KEY,
+    VECTORSTORE_DIR,
+    PROCESSED_DIR,
+    FAISS_HNSW_FACTORY,
+    FAISS_IVFPQ_FACTORY,
+    FAISS_IVFPQ_MIN_CHUNKS,
+    EMBED_BATCH_SIZE,
+    EMBED_CONCURRENCY,
+)
+from rag.ingest import ingest_all, save_chunks
+
+
+async def embed_texts(embeddings: OpenAIEmbeddings, texts: List[str]) -> List[List[float]]:
+    """
+    Embeds texts in EMBED_BATCH_SIZE batches, with up to EMBED_CONCURRENCY
+    requests in flight. Output order matches the input order.
+    """
+    sem = asyncio.Semaphore(EMBED_CONCURRENCY)
+
+    async def embed_batch(batch: List[str]) -> List[List[float]]:
+        async with sem:
+            return await embeddings.aembed_documents(batch)
+
+    batches = [texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+    results = await asyncio.gather(*(embed_batch(b) for b in batches))
+    return [v for batch_vectors in results for v in batch_vectors]
+
+
+def make_faiss_index(vectors: np.ndarray) -> faiss.Index:
+    """
+    HNSW over SQ8 codes gives log-time ANN search at 1/4 of the FP32 footprint;
+    very large corpora switch to OPQ+IVF+PQ (64 bits per vector). Both quantizers
+    are trained on the corpus embeddings.
+    L2 metric is kept so LangChain's relevance scores (and MIN_RELEVANCE) are unchanged.
+    """
+    n, dim = vectors.shape
+    factory = FAISS_IVFPQ_FACTORY if n >= FAISS_IVFPQ_MIN_CHUNKS else FAISS_HNSW_FACTORY
+    index = faiss.index_factory(dim, factory)
+    if not index.is_trained:
+        index.train(vectors)
+    return index
+
 
 def build_index() -> None:
     if not OPENAI_API_KEY:
@@ -16,24 +64,45 @@ def build_index() -> None:
     os.makedirs(PROCESSED_DIR, exist_ok=True)
 
     chunks = ingest_all()
+    build_id = uuid.uuid4().hex
+
+    embeddings = OpenAIEmbeddings(model=OPENAI_EMBED_MODEL, chunk_size=EMBED_BATCH_SIZE)
 
-    # save a small manifest for debugging/observability
+    texts = [c.page_content for c in chunks]
+    metadatas = [c.metadata for c in chunks]
+    vectors = asyncio.run(embed_texts(embeddings, texts))
+
+    db = FAISS(
+        embedding_function=embeddings,
+        index=make_faiss_index(np.asarray(vectors, dtype="float32")),
+        docstore=InMemoryDocstore(),
+        index_to_docstore_id={},
+    )
+    db.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas)
+    db.save_local(VECTORSTORE_DIR)
+
+    # chunks for the UI/BM25, stamped with this build's id; like the manifest,
+    # only written once the index it must match has been saved
+    save_chunks(chunks, build_id)
+
+    # save a small manifest for debugging/observability. Written last: a failed
+    # rebuild must not change the manifest hash (which would wipe the answer
+    # cache for an unchanged index), and its build_id must name a complete build
     manifest_path = os.path.join(PROCESSED_DIR, "manifest.json")
     with open(manifest_path, "w", encoding="utf-8") as f:
         json.dump(
             {
                 "num_chunks": len(chunks),
+                # must match the build_id stamped into chunks.arrow
+                "build_id": build_id,
+                # changes on every rebuild, which invalidates the answer cache
+                "built_at": datetime.now(timezone.utc).isoformat(),
                 "example_metadata": chunks[0].metadata if chunks else {},
             },
             f,
             indent=2,
         )
 
-    embeddings = OpenAIEmbeddings(model=OPENAI_EMBED_MODEL)
-
-    db = FAISS.from_documents(chunks, embeddings)
-    db.save_local(VECTORSTORE_DIR)
-
     print(f" Built FAISS index with {len(chunks)} chunks at: {VECTORSTORE_DIR}")
 
 if __name__ == "__main__":
@@ -1,11 +1,25 @@
 import os
-from typing import List, Dict, Any
+import json
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Tuple, Optional
 
+import pyarrow as pa
 from langchain_community.document_loaders import PyPDFLoader, TextLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
 
-from rag.config import RAW_DIR, CHUNK_SIZE, CHUNK_OVERLAP
+from rag.config import RAW_DIR, PROCESSED_DIR, CHUNK_SIZE, CHUNK_OVERLAP, CHUNKS_FILE
+
+# text + the columns we filter on; the full metadata dict rides along as JSON
+# because PDF metadata keys/types vary from file to file
+CHUNKS_SCHEMA = pa.schema(
+    [
+        ("text", pa.string()),
+        ("source", pa.string()),
+        ("industry", pa.string()),
+        ("metadata", pa.string()),
+    ]
+)
 
 def load_one_file(path: str) -> List[Document]:
     if path.lower().endswith(".pdf"):
@@ -25,8 +39,8 @@ def add_industry_metadata(docs: List[Document], industry: str, source: str) -> L
     return out
 
 def ingest_all() -> List[Document]:
-    all_docs: List[Document] = []
-
+    # collect files first, then parse them in parallel (PDF parsing is CPU-bound)
+    files: List[Tuple[str, str, str]] = []
     for industry in os.listdir(RAW_DIR):
         industry_dir = os.path.join(RAW_DIR, industry)
         if not os.path.isdir(industry_dir):
@@ -36,8 +50,13 @@ def ingest_all() -> List[Document]:
             path = os.path.join(industry_dir, fname)
             if not os.path.isfile(path):
                 continue
+            files.append((industry, fname, path))
 
-            docs = load_one_file(path)
+    all_docs: List[Document] = []
+    with ProcessPoolExecutor() as ex:
+        # map() keeps input order, so chunk_ids match a serial load
+        loaded = ex.map(load_one_file, [path for _, _, path in files])
+        for (industry, fname, _), docs in zip(files, loaded):
             docs = add_industry_metadata(docs, industry=industry, source=f"{industry}/{fname}")
             all_docs.extend(docs)
 
@@ -57,4 +76,55 @@ def ingest_all() -> List[Document]:
         if "page" not in c.metadata:
             c.metadata["page"] = None
 
-    return chunks
\ No newline at end of file
+    return chunks
+
+
+class StaleChunksError(RuntimeError):
+    """chunks.arrow was not written by the build that produced the current index."""
+
+
+def current_build_id() -> Optional[str]:
+    try:
+        with open(os.path.join(PROCESSED_DIR, "manifest.json"), encoding="utf-8") as f:
+            return json.load(f).get("build_id")
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def save_chunks(chunks: List[Document], build_id: str, path: str = CHUNKS_FILE) -> None:
+    # the build id ties the file to one FAISS build (see load_chunks)
+    schema = CHUNKS_SCHEMA.with_metadata({"build_id": build_id})
+    table = pa.Table.from_pylist(
+        [
+            {
+                "text": c.page_content,
+                "source": c.metadata.get("source"),
+                "industry": c.metadata.get("industry"),
+                "metadata": json.dumps(c.metadata, default=str),
+            }
+            for c in chunks
+        ],
+        schema=schema,
+    )
+    with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+        writer.write_table(table)
+
+
+def load_chunks(path: str = CHUNKS_FILE) -> List[Document]:
+    """
+    Loads the chunks written by save_chunks() via a memory map,
+    without re-parsing any raw documents.
+
+    Raises StaleChunksError if the file's build id doesn't match the manifest,
+    i.e. its chunk keys may not line up with the FAISS docstore.
+    """
+    with pa.memory_map(path, "r") as source:
+        reader = pa.ipc.open_file(source)
+        file_build_id = (reader.schema.metadata or {}).get(b"build_id", b"").decode()
+        if not file_build_id or file_build_id != current_build_id():
+            raise StaleChunksError(f"{path} does not match the current index build")
+        table = reader.read_all()
+
+    texts = table.column("text").to_pylist()
+    metadatas = table.column("metadata").to_pylist()
+    return [Document(page_content=t, metadata=json.loads(m)) for t, m in zip(texts, metadatas)]
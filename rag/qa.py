@@ -1,13 +1,17 @@
-from typing import List, Dict, Any, Optional, Tuple
-from collections import defaultdict
+import asyncio
+from typing import List, Dict, Any, Optional, Tuple, Iterator
 
 from langchain_openai import ChatOpenAI
+from langchain_community.vectorstores import FAISS
 from langchain_core.documents import Document
 
 from rag.config import OPENAI_MODEL
-from rag.retrieval import retrieve
+from rag.retrieval import aretrieve
+from rag.cache import get_answer_cache, answer_cache_key
 
 
+IDK_ANSWER = "I don't know based on the provided documents."
+
 SYSTEM_PROMPT = """You are a RAG assistant.
 
 Rules:
@@ -47,97 +51,171 @@ def group_citations_by_source(docs: List[Document]) -> List[Dict[str, Any]]:
       ...
     ]
     """
-    grouped: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    grouped: Dict[str, Dict[str, Any]] = {}
+    seen = set()
 
+    # single pass: first doc of a source fixes its industry; dedupe by (src, page, chunk_id)
     for d in docs:
-        src = d.metadata.get("source")
-        grouped[src].append(
-            {
-                "industry": d.metadata.get("industry"),
-                "page": d.metadata.get("page"),
-                "chunk_id": d.metadata.get("chunk_id"),
-            }
-        )
+        md = d.metadata
+        src, page, chunk = md.get("source"), md.get("page"), md.get("chunk_id")
 
-    results: List[Dict[str, Any]] = []
-    for src, items in grouped.items():
-        # Deduplicate by (page, chunk_id)
-        seen = set()
-        clean_refs = []
-        for it in items:
-            key = (it.get("page"), it.get("chunk_id"))
-            if key in seen:
-                continue
-            seen.add(key)
-            clean_refs.append({"page": it.get("page"), "chunk_id": it.get("chunk_id")})
-
-        results.append(
-            {
-                "source": src,
-                "industry": items[0].get("industry") if items else None,
-                "references": clean_refs,
-            }
-        )
+        entry = grouped.get(src)
+        if entry is None:
+            entry = grouped[src] = {"source": src, "industry": md.get("industry"), "references": []}
+
+        key = (src, page, chunk)
+        if key in seen:
+            continue
+        seen.add(key)
+        entry["references"].append({"page": page, "chunk_id": chunk})
+
+    results: List[Dict[str, Any]] = list(grouped.values())
 
     # stable ordering (most references first)
     results.sort(key=lambda x: len(x.get("references", [])), reverse=True)
     return results
 
 
-def answer_question(
+def build_messages(
     question: str,
-    all_docs_for_bm25: List[Document],
-    industry_filter: Optional[str] = None,
+    docs: List[Document],
     chat_history: Optional[List[Tuple[str, str]]] = None,
-) -> Dict[str, Any]:
-    docs, _ = retrieve(question, all_docs_for_bm25, industry_filter=industry_filter)
-
-    if not docs:
-        return {
-            "answer": "I don't know based on the provided documents.",
-            "citations": [],
-        }
-
-    llm = ChatOpenAI(model=OPENAI_MODEL, temperature=0, max_tokens=260)
-
-    history_txt = ""
-    if chat_history:
-        pairs = chat_history[-6:]
-        history_txt = "\n".join([f"User: {u}\nAssistant: {a}" for u, a in pairs])
-
-    context = build_context(docs)
-
-    user_prompt = f"""CHAT HISTORY (optional):
-{history_txt}
-
-QUESTION:
+) -> List[Dict[str, str]]:
+    # prior turns go in as real chat messages, so the system + history prefix is
+    # identical across turns (server-side prompt caching) and only the new turn
+    # (question + retrieved context) is built here
+    history: List[Dict[str, str]] = []
+    for u, a in (chat_history or [])[-6:]:
+        history.append({"role": "user", "content": u})
+        history.append({"role": "assistant", "content": a})
+
+    user_prompt = f"""QUESTION:
 {question}
 
 CONTEXT:
-{context}
+{build_context(docs)}
 
 Answer the QUESTION using only the CONTEXT.
 Do not include citations in the answer.
 """
 
-    resp = llm.invoke(
-        [
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": user_prompt},
-        ]
-    )
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        *history,
+        {"role": "user", "content": user_prompt},
+    ]
+
 
-    answer_text = (resp.content or "").strip()
+def finalize_answer(answer_text: str, docs: List[Document]) -> Dict[str, Any]:
+    answer_text = (answer_text or "").strip()
 
-    
     # If the model refuses ("I don't know..."), do NOT show citations.
     if answer_text.lower().startswith("i don't know based on the provided documents"):
         return {
-            "answer": "I don't know based on the provided documents.",
+            "answer": IDK_ANSWER,
             "citations": [],
         }
 
     return {
         "answer": answer_text,
         "citations": group_citations_by_source(docs),
-    }
\ No newline at end of file
+    }
+
+
+async def aanswer_question(
+    question: str,
+    all_docs_for_bm25: List[Document],
+    industry_filter: Optional[str] = None,
+    chat_history: Optional[List[Tuple[str, str]]] = None,
+    vectorstore: Optional[FAISS] = None,
+) -> Dict[str, Any]:
+    docs, _ = await aretrieve(
+        question,
+        all_docs_for_bm25,
+        industry_filter=industry_filter,
+        vectorstore=vectorstore,
+    )
+
+    if not docs:
+        return {
+            "answer": IDK_ANSWER,
+            "citations": [],
+        }
+
+    messages = build_messages(question, docs, chat_history)
+
+    # same model + prompt + context -> same answer (temperature=0)
+    cache = get_answer_cache()
+    cache_key = answer_cache_key(OPENAI_MODEL, messages)
+    answer_text = cache.get(cache_key)
+    if answer_text is None:
+        llm = ChatOpenAI(model=OPENAI_MODEL, temperature=0, max_tokens=260)
+        resp = await llm.ainvoke(messages)
+        answer_text = (resp.content or "").strip()
+        cache.set(cache_key, answer_text)
+
+    return finalize_answer(answer_text, docs)
+
+
+def answer_question(
+    question: str,
+    all_docs_for_bm25: List[Document],
+    industry_filter: Optional[str] = None,
+    chat_history: Optional[List[Tuple[str, str]]] = None,
+    vectorstore: Optional[FAISS] = None,
+) -> Dict[str, Any]:
+    # sync entry point for Streamlit: one event loop per request
+    return asyncio.run(
+        aanswer_question(
+            question,
+            all_docs_for_bm25,
+            industry_filter=industry_filter,
+            chat_history=chat_history,
+            vectorstore=vectorstore,
+        )
+    )
+
+
+def _stream_llm(messages: List[Dict[str, str]]) -> Iterator[str]:
+    cache = get_answer_cache()
+    cache_key = answer_cache_key(OPENAI_MODEL, messages)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        yield cached
+        return
+
+    llm = ChatOpenAI(model=OPENAI_MODEL, temperature=0, max_tokens=260, streaming=True)
+    parts: List[str] = []
+    for chunk in llm.stream(messages):
+        if chunk.content:
+            parts.append(chunk.content)
+            yield chunk.content
+
+    cache.set(cache_key, "".join(parts).strip())
+
+
+def answer_question_stream(
+    question: str,
+    all_docs_for_bm25: List[Document],
+    industry_filter: Optional[str] = None,
+    chat_history: Optional[List[Tuple[str, str]]] = None,
+    vectorstore: Optional[FAISS] = None,
+) -> Tuple[Iterator[str], List[Document]]:
+    """
+    Streaming variant of answer_question: returns (token stream, retrieved docs).
+    Consume the stream (e.g. st.write_stream), then pass the full text and docs
+    to finalize_answer() to get the answer/citations dict.
+    """
+    docs, _ = asyncio.run(
+        aretrieve(
+            question,
+            all_docs_for_bm25,
+            industry_filter=industry_filter,
+            vectorstore=vectorstore,
+        )
+    )
+
+    if not docs:
+        return iter([IDK_ANSWER]), []
+
+    return _stream_llm(build_messages(question, docs, chat_history)), docs
@@ -1,86 +1,229 @@
-from typing import List, Optional, Dict, Any, Tuple
-from collections import defaultdict
-
+import asyncio
+import re
+from typing import List, Optional, Dict, Any, Tuple, Sequence
+from functools import lru_cache
+
+import bm25s
+import faiss
+import numpy as np
 from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import FAISS
-from langchain_community.retrievers import BM25Retriever
 from langchain_core.documents import Document
 
-from rag.config import VECTORSTORE_DIR, OPENAI_EMBED_MODEL, TOP_K, MIN_RELEVANCE
+from rag.batching import QueryBatcher
+from rag.cache import LRUCache, normalize_query
+from rag.config import (
+    VECTORSTORE_DIR,
+    OPENAI_EMBED_MODEL,
+    TOP_K,
+    MIN_RELEVANCE,
+    FAISS_EF_SEARCH,
+    FAISS_NPROBE,
+    FAISS_USE_GPU,
+    RETRIEVAL_CACHE_SIZE,
+)
+
+
+@lru_cache(maxsize=1)
+def get_embeddings() -> OpenAIEmbeddings:
+    return OpenAIEmbeddings(model=OPENAI_EMBED_MODEL)
+
+
+def tune_faiss_index(index: faiss.Index) -> None:
+    # query-time knobs for ANN indices (no-op for flat indices)
+    hnsw = getattr(index, "hnsw", None)
+    if hnsw is not None:
+        hnsw.efSearch = FAISS_EF_SEARCH
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = FAISS_NPROBE
+
+
+def to_gpu_if_available(index: faiss.Index) -> faiss.Index:
+    # faiss-cpu builds have no GPU symbols; CPU stays the default path
+    if not FAISS_USE_GPU or not hasattr(faiss, "StandardGpuResources"):
+        return index
+    try:
+        if faiss.get_num_gpus() == 0:
+            return index
+        return faiss.index_cpu_to_all_gpus(index)
+    except Exception:
+        # e.g. HNSW has no GPU implementation
+        return index
+
+
+@lru_cache(maxsize=1)
+def load_vectorstore() -> FAISS:
+    # loaded once per process; callers share the same FAISS object
+    vs = FAISS.load_local(VECTORSTORE_DIR, get_embeddings(), allow_dangerous_deserialization=True)
+    tune_faiss_index(vs.index)
+    vs.index = to_gpu_if_available(vs.index)
+    return vs
 
 
-def load_vectorstore() -> FAISS:
-    embeddings = OpenAIEmbeddings(model=OPENAI_EMBED_MODEL)
-    return FAISS.load_local(VECTORSTORE_DIR, embeddings, allow_dangerous_deserialization=True)
+@lru_cache(maxsize=1)
+def get_query_batcher(vs: FAISS) -> QueryBatcher:
+    # industry filtering happens inside FAISS, so TOP_K hits are all usable
+    return QueryBatcher(vs, k=TOP_K)
 
 
-def filter_docs(docs: List[Document], industry_filter: Optional[str]) -> List[Document]:
-    if not industry_filter:
-        return docs
-    return [d for d in docs if (d.metadata.get("industry") == industry_filter)]
+@lru_cache(maxsize=1)
+def _faiss_industries(vs: FAISS) -> np.ndarray:
+    # industry label per FAISS integer id, built once per vectorstore
+    labels = []
+    for i in range(vs.index.ntotal):
+        doc = vs.docstore.search(vs.index_to_docstore_id[i])
+        industry = doc.metadata.get("industry") if isinstance(doc, Document) else None
+        labels.append(industry or "")
+    return np.array(labels, dtype=str)
 
 
-def infer_industries_from_query(query: str) -> List[str]:
-    """
-    Heuristic mapper from query text -> your metadata industry labels.
-    Only used when user did NOT set an explicit industry_filter.
-    """
-    q = query.lower()
-    inds: List[str] = []
+@lru_cache(maxsize=64)
+def faiss_industry_ids(vs: FAISS, industries: Tuple[str, ...]) -> np.ndarray:
+    """Sorted int64 FAISS ids of the vectors whose industry is in `industries`."""
+    return np.flatnonzero(np.isin(_faiss_industries(vs), industries)).astype("int64")
+
 
-    # Banking
-    if any(w in q for w in ["bank", "banking", "capital markets", "credit union"]):
-        inds.append("banking")
+# (id(vectorstore), normalized query, industry_filter, top_k) -> (vectorstore, docs)
+_retrieval_cache = LRUCache(RETRIEVAL_CACHE_SIZE)
 
-    # Insurance
-    if any(w in q for w in ["insurer", "insurers", "insurance", "underwriting", "claims"]):
-        inds.append("insurance")
 
-    # Healthcare
-    if any(w in q for w in ["healthcare", "hospital", "payer", "provider", "medicare", "medicaid"]):
-        inds.append("healthcare")
+# Corpus the BM25S indices are built over; rebuilt only when a different corpus
+# shows up (see prepare_bm25).
+_bm25_corpus: Sequence[Document] = ()
+_bm25_fingerprint: Optional[Tuple[Any, ...]] = None
+# industry label per corpus position (fixed-width unicode so comparisons vectorize);
+# bm25_search turns it into the weight mask for multi-industry queries
+_bm25_industries: np.ndarray = np.empty(0, dtype="U1")
+# industry -> (BM25S index, docs); the None key holds the index over the whole corpus
+_bm25_indexes: Dict[Optional[str], Tuple[bm25s.BM25, Sequence[Document]]] = {}
 
-    # Life sciences
-    if any(w in q for w in ["life sciences", "lifesciences", "pharma", "biotech", "medtech"]):
-        inds.append("lifesciences")
 
-    # Manufacturing
-    if any(w in q for w in ["manufacturing", "factory", "supply chain", "plant"]):
-        inds.append("manufacturing")
+def _corpus_fingerprint(docs: Sequence[Document]) -> Tuple[Any, ...]:
+    # every chunk's (source, page, chunk_id, start_index): O(N) tuple hashing,
+    # still far cheaper than re-indexing, and catches edits anywhere in the corpus
+    return (len(docs), hash(tuple(_doc_key(d) for d in docs)))
 
-    # High tech
-    if any(w in q for w in ["high tech", "hightech", "semiconductor", "chip", "electronics"]):
-        inds.append("hightech")
 
-    # Comms / telecom
-    if any(w in q for w in ["telecom", "telco", "communications", "comms"]):
-        inds.append("comms")
+def _tokenize(texts):
+    return bm25s.tokenize(texts, stopwords="en", show_progress=False)
 
-    # Energy
-    if any(w in q for w in ["energy", "oil", "gas", "utilities", "power"]):
-        inds.append("energy")
 
-    # Retail
-    if any(w in q for w in ["retail", "store", "e-commerce", "ecommerce"]):
-        inds.append("retail")
+def _build_bm25s(docs: Sequence[Document]) -> bm25s.BM25:
+    retriever = bm25s.BM25()
+    retriever.index(_tokenize([d.page_content for d in docs]), show_progress=False)
+    return retriever
 
-    # Private equity
-    if any(w in q for w in ["private equity", "privateequity", "pe firm"]):
-        inds.append("privateequity")
 
+def prepare_bm25(docs: Sequence[Document]) -> None:
+    """
+    Builds one BM25S index over the whole corpus plus one per industry.
+    Call once at startup; calling again with the same corpus (same object, or
+    the same chunk keys in the same order) is a no-op. Pass the same cached
+    sequence every time to skip even the key check.
+    """
+    global _bm25_corpus, _bm25_fingerprint, _bm25_industries, _bm25_indexes
+    if docs is _bm25_corpus:
+        return
+    # callers may pass a fresh list of the same chunks on every query; only a
+    # different set/order of chunk keys triggers a rebuild
+    fingerprint = _corpus_fingerprint(docs)
+    if fingerprint == _bm25_fingerprint:
+        return
+
+    # np.array sizes the <U dtype to the longest label, so nothing is truncated
+    industries = np.array([d.metadata.get("industry") or "" for d in docs], dtype=str)
+    indexes: Dict[Optional[str], Tuple[bm25s.BM25, Sequence[Document]]] = {}
+    if docs:
+        indexes[None] = (_build_bm25s(docs), docs)
+    for industry in np.unique(industries):
+        if not industry:
+            continue
+        group = [docs[i] for i in np.flatnonzero(industries == industry)]
+        indexes[str(industry)] = (_build_bm25s(group), group)
+
+    _bm25_corpus, _bm25_fingerprint = docs, fingerprint
+    _bm25_industries, _bm25_indexes = industries, indexes
+    _retrieval_cache.clear()
+
+
+def bm25_search(query: str, industries: List[str], k: int = TOP_K) -> List[Document]:
+    """
+    Top-k BM25 hits restricted to `industries` (whole corpus if empty).
+    A single industry uses its own index. Several industries are scored by the
+    whole-corpus index masked to their union: scores from separate indices
+    (different N, avgdl, IDF) are not comparable.
+    """
+    tokens = _tokenize(query)
+
+    if len(industries) > 1:
+        entry = _bm25_indexes.get(None)
+        mask = np.isin(_bm25_industries, industries)
+        n_allowed = int(mask.sum())
+        if entry is None or not n_allowed:
+            return []
+        retriever, docs = entry
+        # Masked-out docs score 0, tying with allowed docs that miss every query
+        # term. Over-fetch by the number of masked-out docs so at least
+        # min(k, n_allowed) allowed docs survive the mask, like the single-index path.
+        n_fetch = min(k + (len(docs) - n_allowed), len(docs))
+        results, _ = retriever.retrieve(
+            tokens,
+            k=n_fetch,
+            weight_mask=mask.astype("float32"),
+            show_progress=False,
+        )
+        return [docs[i] for i in results[0] if mask[i]][:k]
+
+    entry = _bm25_indexes.get(industries[0] if industries else None)
+    if entry is None:
+        return []
+    retriever, docs = entry
+    results, _ = retriever.retrieve(tokens, k=min(k, len(docs)), show_progress=False)
+    return [docs[i] for i in results[0]]
+
+
+# industry label -> query keywords; dict order is the order industries are reported
+INDUSTRY_KEYWORDS: Dict[str, List[str]] = {
+    "banking": ["bank", "banking", "capital markets", "credit union"],
+    "insurance": ["insurer", "insurers", "insurance", "underwriting", "claims"],
+    "healthcare": ["healthcare", "hospital", "payer", "provider", "medicare", "medicaid"],
+    "lifesciences": ["life sciences", "lifesciences", "pharma", "biotech", "medtech"],
+    "manufacturing": ["manufacturing", "factory", "supply chain", "plant"],
+    "hightech": ["high tech", "hightech", "semiconductor", "chip", "electronics"],
+    "comms": ["telecom", "telco", "communications", "comms"],
+    "energy": ["energy", "oil", "gas", "utilities", "power"],
+    "retail": ["retail", "store", "e-commerce", "ecommerce"],
+    "privateequity": ["private equity", "privateequity", "pe firm"],
     # Consumer categories (only if explicitly mentioned)
-    if any(w in q for w in ["consumer tech", "consumertech"]):
-        inds.append("consumertech")
+    "consumertech": ["consumer tech", "consumertech"],
+    "consumergoods": ["consumer goods", "consumergoods", "cpg"],
+    # Software (only if explicitly mentioned)
+    "software": ["software", "saas"],
+}
 
-    if any(w in q for w in ["consumer goods", "consumergoods", "cpg"]):
-        inds.append("consumergoods")
+_KEYWORD_TO_INDUSTRY: Dict[str, str] = {
+    kw: industry for industry, kws in INDUSTRY_KEYWORDS.items() for kw in kws
+}
 
-    # Software (only if explicitly mentioned)
-    if any(w in q for w in ["software", "saas"]):
-        inds.append("software")
+# One scan for all keywords. The lookahead makes every start position match, so
+# overlapping keywords are all found, i.e. the same substring semantics as `kw in q`.
+# Matched against query.lower() (no re.IGNORECASE): Unicode case-folding would
+# match text whose .lower() is not a dict key (e.g. "İ", "ſ").
+_KEYWORD_RE = re.compile(
+    "(?=("
+    + "|".join(re.escape(kw) for kw in sorted(_KEYWORD_TO_INDUSTRY, key=len, reverse=True))
+    + "))"
+)
 
-    # de-dupe preserving order
-    return list(dict.fromkeys(inds))
+
+def infer_industries_from_query(query: str) -> List[str]:
+    """
+    Heuristic mapper from query text -> your metadata industry labels.
+    Only used when user did NOT set an explicit industry_filter.
+    """
+    found = {_KEYWORD_TO_INDUSTRY[m] for m in _KEYWORD_RE.findall(query.lower())}
+    return [industry for industry in INDUSTRY_KEYWORDS if industry in found]
 
 
 def format_citations(docs: List[Document]) -> List[Dict[str, Any]]:
@@ -97,27 +240,30 @@ def format_citations(docs: List[Document]) -> List[Dict[str, Any]]:
     return cites
 
 
+RED_FLAGS = [
+    "ignore previous instructions",
+    "system prompt",
+    "developer message",
+    "exfiltrate",
+    "api key",
+    "password",
+]
+
+# all red flags in one case-insensitive pattern: a single scan per query
+RED_FLAG_RE = re.compile("|".join(map(re.escape, RED_FLAGS)), re.IGNORECASE)
+
+
 def is_prompt_injection(text: str) -> bool:
-    red_flags = [
-        "ignore previous instructions",
-        "system prompt",
-        "developer message",
-        "exfiltrate",
-        "api key",
-        "password",
-    ]
-    t = text.lower()
-    return any(r in t for r in red_flags)
-
-
-def _doc_key(d: Document) -> str:
+    return RED_FLAG_RE.search(text) is not None
+
+
+DocKey = Tuple[Any, Any, Any, Any]
+
+
+def _doc_key(d: Document) -> DocKey:
     # stable identity for merging results
-    return (
-        f"{d.metadata.get('source')}|"
-        f"{d.metadata.get('page')}|"
-        f"{d.metadata.get('chunk_id')}|"
-        f"{d.metadata.get('start_index')}"
-    )
+    md = d.metadata
+    return (md.get("source"), md.get("page"), md.get("chunk_id"), md.get("start_index"))
 
 
 def rrf_merge(
@@ -130,78 +276,105 @@ def rrf_merge(
     Reciprocal Rank Fusion:
     score(doc) = sum_i 1 / (rrf_k + rank_i)
     """
-    scores = defaultdict(float)
-    doc_map: Dict[str, Document] = {}
-
-    for rank, d in enumerate(bm25_docs, start=1):
-        key = _doc_key(d)
-        scores[key] += 1.0 / (rrf_k + rank)
-        doc_map[key] = d
+    scores: Dict[DocKey, float] = {}
+    doc_map: Dict[DocKey, Document] = {}
 
-    for rank, d in enumerate(vec_docs, start=1):
-        key = _doc_key(d)
-        scores[key] += 1.0 / (rrf_k + rank)
-        doc_map[key] = d
+    for docs in (bm25_docs, vec_docs):
+        for rank, d in enumerate(docs, start=1):
+            key = _doc_key(d)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            doc_map[key] = d
 
     ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)
     out = [doc_map[key] for key, _ in ranked[:k]]
     return out
 
 
-def retrieve(
+async def aretrieve_vec(
     query: str,
-    all_docs_for_bm25: List[Document],
-    industry_filter: Optional[str] = None,
-) -> Tuple[List[Document], List[Dict[str, Any]]]:
+    vs: FAISS,
+    industries: Tuple[str, ...],
+) -> Tuple[List[Document], float]:
+    # one embedding + one search; docs and relevance threshold both come from it
+    allowed_ids = faiss_industry_ids(vs, industries) if industries else None
+    hits = await get_query_batcher(vs).asearch(query, allowed_ids)
 
-    if is_prompt_injection(query):
-        return [], []
+    if allowed_ids is not None:
+        # no-op when FAISS applied the selector; needed when it could not (GPU index)
+        ids = np.fromiter((i for i, _, _ in hits), dtype="int64", count=len(hits))
+        keep = np.isin(ids, allowed_ids, assume_unique=True)
+        hits = [h for h, k in zip(hits, keep) if k]
 
-    # If user didn't set explicit filter, but query mentions industries, restrict to them
-    inferred_industries = infer_industries_from_query(query) if not industry_filter else []
+    vec_docs = [d for _, d, _ in hits]
+
+    # Relevance threshold (use only allowed industries)
+    best = max((score for _, _, score in hits), default=0.0)
+    return vec_docs, best
 
-    def allow_doc(d: Document) -> bool:
-        if industry_filter:
-            return d.metadata.get("industry") == industry_filter
-        if inferred_industries:
-            return d.metadata.get("industry") in inferred_industries
-        return True
 
-    # BM25 retrieval (lexical)
+async def _aretrieve_docs(
+    query: str,
+    industry_filter: Optional[str],
+    vs: FAISS,
+) -> List[Document]:
+    # If user didn't set explicit filter, but query mentions industries, restrict to them
     if industry_filter:
-        bm25_corpus = filter_docs(all_docs_for_bm25, industry_filter)
-    elif inferred_industries:
-        bm25_corpus = [d for d in all_docs_for_bm25 if allow_doc(d)]
+        industries: Tuple[str, ...] = (industry_filter,)
     else:
-        bm25_corpus = all_docs_for_bm25
+        industries = tuple(infer_industries_from_query(query))
+
+    # BM25 (lexical, CPU) runs in a worker thread while the query is embedded
+    # and searched in FAISS (semantic, network-bound). Both sides are already
+    # restricted to `industries`, so the merge needs no further filtering.
+    bm25_docs, (vec_docs, best) = await asyncio.gather(
+        asyncio.to_thread(bm25_search, query, list(industries), TOP_K),
+        aretrieve_vec(query, vs, industries),
+    )
 
-    
-    if not bm25_corpus:
-        return [], []
+    if not bm25_docs:
+        return []
 
-    bm25 = BM25Retriever.from_documents(bm25_corpus)
-    bm25.k = TOP_K
-    bm25_docs = bm25.invoke(query)
+    if best < MIN_RELEVANCE:
+        return []
 
-    # Vector retrieval (semantic)
-    vs = load_vectorstore()
+    # Hybrid merge
+    return rrf_merge(bm25_docs, vec_docs, k=TOP_K)
 
-    vec_docs = vs.similarity_search(query, k=TOP_K * 2)
-    vec_docs = [d for d in vec_docs if allow_doc(d)]
 
-    # Relevance threshold (use only allowed industries)
-    scored = vs.similarity_search_with_relevance_scores(query, k=TOP_K * 2)
-    best = 0.0
-    for d, score in scored:
-        if allow_doc(d):
-            best = max(best, float(score))
+async def aretrieve(
+    query: str,
+    all_docs_for_bm25: List[Document],
+    industry_filter: Optional[str] = None,
+    vectorstore: Optional[FAISS] = None,
+) -> Tuple[List[Document], List[Dict[str, Any]]]:
 
-    if best < MIN_RELEVANCE:
+    if is_prompt_injection(query):
         return [], []
 
-    # Hybrid merge
-    merged = rrf_merge(bm25_docs, vec_docs, k=TOP_K)
-    # Ensure merged also respects allow_doc (bm25 may include some edge cases)
-    merged = [d for d in merged if allow_doc(d)]
+    prepare_bm25(all_docs_for_bm25)
+    vs = vectorstore if vectorstore is not None else load_vectorstore()
+
+    # repeated questions skip BM25, embedding and FAISS entirely
+    # keyed per vectorstore; the entry keeps a reference to the store so a reused
+    # id() of a garbage-collected store can't return its docs
+    cache_key = (id(vs), normalize_query(query), industry_filter, TOP_K)
+    cached = _retrieval_cache.get(cache_key)
+    if cached is not None and cached[0] is vs:
+        docs = cached[1]
+    else:
+        docs = tuple(await _aretrieve_docs(query, industry_filter, vs))
+        _retrieval_cache.put(cache_key, (vs, docs))
 
-    return merged, format_citations(merged)
\ No newline at end of file
+    merged = list(docs)
+    return merged, format_citations(merged)
+
+
+def retrieve(
+    query: str,
+    all_docs_for_bm25: List[Document],
+    industry_filter: Optional[str] = None,
+    vectorstore: Optional[FAISS] = None,
+) -> Tuple[List[Document], List[Dict[str, Any]]]:
+    return asyncio.run(
+        aretrieve(query, all_docs_for_bm25, industry_filter=industry_filter, vectorstore=vectorstore)
+    )